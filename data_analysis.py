@@ -1,15 +1,25 @@
 import datetime
+import functools
+import hashlib
 
 import pandas as pd
 import geopandas as gpd
 import numpy as np
 import osmnx as ox
 import networkx as nx
+import shapely
 
+from shapely import STRtree
 from shapely.geometry import Point
+from shapely.geometry.base import BaseGeometry
 from shapely.ops import unary_union
-from typing import Union, List
+from typing import Union, List, NamedTuple
 from pathlib import Path
+from collections import OrderedDict
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
 from statsmodels.tsa.seasonal import MSTL
 
 from uo_api_interface import *
@@ -27,41 +37,116 @@ def filter_by_broker_name(gdf: gpd.GeoDataFrame, broker_names: Union[str, List[s
     
     return gdf[gdf["Broker_Name"].isin(broker_names)]
 
-def find_closest_sensors(gdf: gpd.GeoDataFrame, point: Point, broker_name: str, n: int) -> list[str]:
+def filter_within_boundary(gdf: gpd.GeoDataFrame, boundary: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     """
-    Function that finds n closest sensors to a given point.
+    Function that removes any sensors from the given GeoDataFrame that do not intersect the boundary geometries.
 
-    Returns a list of sensor names, in ascending order of distance from the point.
+    Queries a spatial index of the sensors directly with the boundary, rather than running a full spatial join that only keeps the left rows.
+
+    Returns a GeoPandas GeoDataFrame.
     """
-    #As with other functions, creates a copy of the original data to avoid unintentionally mutating it.
-    gdf = gdf.copy()
-    gdf = filter_by_broker_name(gdf, broker_name)
 
-    fixed_point = gpd.GeoSeries([point], crs=gdf.crs).to_crs("EPSG:27700")[0]
+    tree = STRtree(gdf.geometry.values)
+    _, sensor_positions = tree.query(boundary.to_crs(gdf.crs).geometry.values, predicate="intersects")
 
-    #Transform from lat/long projection to one in meters so a distance can be calculated.
-    gdf.to_crs("EPSG:27700", inplace=True)
+    #A sensor inside more than one boundary polygon should still only appear once, in its original order.
+    return gdf.iloc[np.unique(sensor_positions)]
 
-    gdf["Distance"] = gdf.geometry.distance(fixed_point)
-    gdf.sort_values("Distance", inplace=True)
+@functools.lru_cache(maxsize=None)
+def get_transformer(from_crs, to_crs) -> Transformer:
+    """
+    Function that gets a coordinate transformer between two CRSs, setting up the PROJ pipeline only the first time the pair is requested.
 
-    #Appends the first n sorted location names to a list.
-    l = []
-    for sensor in gdf["Sensor_Name"][0:n]:
-        l.append(sensor)
-    
-    return l
+    Returns a PyProj Transformer.
+    """
+
+    return Transformer.from_crs(from_crs, to_crs, always_xy=True)
+
+class SensorIndex:
+    """
+    Class that holds a spatial index of sensor locations, so repeated closest sensor queries don't need to reproject every sensor.
+    """
+
+    def __init__(self, gdf: gpd.GeoDataFrame):
+        #Transform from lat/long projection to one in meters so a distance can be calculated.
+        self.transformer = get_transformer(gdf.crs, "EPSG:27700")
+
+        coordinates = shapely.get_coordinates(gdf.geometry.values)
+        x, y = self.transformer.transform(coordinates[:, 0], coordinates[:, 1])
+
+        self.names = gdf["Sensor_Name"].to_numpy()
+        self.tree = cKDTree(np.column_stack([x, y]))
+
+    def query(self, point: Point, n: int) -> list[str]:
+        """
+        Function that finds n closest sensors in the index to a given point.
+
+        Returns a list of sensor names, in ascending order of distance from the point.
+        """
+        n = min(n, len(self.names))
+
+        if n <= 0:
+            return []
+
+        #Only the single query point needs reprojecting, reusing the transformer the index was built with.
+        x, y = self.transformer.transform(point.x, point.y)
+
+        _, idx = self.tree.query([x, y], k=n)
+
+        return self.names[np.atleast_1d(idx)].tolist()
+
+#Indexes already built, keyed by the contents of the sensors they were built from, keeping at most SENSOR_INDEX_CACHE_SIZE of the most recently used.
+SENSOR_INDEX_CACHE_SIZE = 8
+_sensor_index_cache = OrderedDict()
+
+def get_sensor_index(gdf: gpd.GeoDataFrame, broker_name: str) -> SensorIndex:
+    """
+    Function that gets a spatial index of the sensors with the given broker name, building it only the first time it is requested.
+
+    Indexes are looked up by the names, locations and CRS of the sensors, so a GeoDataFrame changed in place gets a new index rather than a stale one.
+
+    Returns a SensorIndex.
+    """
+    sensors = filter_by_broker_name(gdf, broker_name)
+
+    digest = hashlib.blake2b(pd.util.hash_pandas_object(sensors["Sensor_Name"], index=False).to_numpy().tobytes())
+    digest.update(shapely.get_coordinates(sensors.geometry.values).tobytes())
+    digest.update(str(sensors.crs).encode())
+    key = digest.digest()
+
+    if key in _sensor_index_cache:
+        _sensor_index_cache.move_to_end(key)
+        return _sensor_index_cache[key]
+
+    index = SensorIndex(sensors)
+    _sensor_index_cache[key] = index
+    if len(_sensor_index_cache) > SENSOR_INDEX_CACHE_SIZE:
+        _sensor_index_cache.popitem(last=False)
+
+    return index
+
+def find_closest_sensors(gdf: gpd.GeoDataFrame, point: Point, broker_name: str, n: int) -> list[str]:
+    """
+    Function that finds n closest sensors to a given point.
 
-def resample_sensors_timeseries(df: pd.DataFrame, freq: str) -> pd.DataFrame:
+    Returns a list of sensor names, in ascending order of distance from the point.
+    """
+    return get_sensor_index(gdf, broker_name).query(point, n)
+
+def resample_sensors_timeseries(df: pd.DataFrame, freq: str, origin: Union[str, pd.Timestamp] = "start_day") -> pd.DataFrame:
     """
     Function that resamples a timeseries to a given frequency.
 
+    Time bins are aligned to origin, which takes the same values as the origin of a Pandas resample.
+
     Returns a Pandas DataFrame of data resampled to frequency.
     """
-    #Group the dataframe by variables that should be resampled with each other, ie each variable of each sensor.
-    grouped = df.groupby(["Sensor_Name", "Variable"]).resample(freq)
+    #Group the dataframe by variables that should be resampled with each other, ie each variable of each sensor, and by time bin.
+    #Grouping on the time bins directly runs one aggregation over the whole frame instead of a separate resample for every group.
+    #Only groups that exist are needed, rather than every combination of categories, and the groups don't need sorting as the result is sorted by time below.
+    grouped = df.groupby(["Sensor_Name", "Variable", pd.Grouper(freq=freq, origin=origin)], observed=True, sort=False)
     
-    #Tell resample how to combine values in different columns.
+    #Tell the grouping how to combine values in different columns.
     resampled_data = grouped.agg({
         "Value": "mean",
         "Flagged": "max"
@@ -81,6 +166,96 @@ def resample_sensors_timeseries(df: pd.DataFrame, freq: str) -> pd.DataFrame:
 
     return df
 
+@functools.lru_cache(maxsize=1)
+def _load_street_network() -> tuple[nx.MultiDiGraph, nx.MultiDiGraph]:
+    """
+    Function that loads the drivable street network graph for newcastle, downloading it only if it hasn't been saved to disk before.
+
+    Returns the graph in lat/long and the graph projected into meters.
+    """
+    graph_path = Path("outputs/data/newcastle_drive.graphml")
+
+    if graph_path.exists():
+        graph = ox.load_graphml(graph_path)
+    else:
+        graph = ox.graph_from_place("Newcastle upon Tyne, UK", network_type="drive")
+        ox.save_graphml(graph, graph_path)
+
+    graph_proj = ox.project_graph(graph)
+
+    return graph, graph_proj
+
+#Routes already found, keyed by origin and destination node, as the street network graph is the same on every call.
+_route_cache = {}
+
+#The projected graph comes from the cached _load_street_network, so it is the same object on every call and its matrix only needs building once.
+@functools.lru_cache(maxsize=1)
+def _build_routing_matrix(graph_proj: nx.MultiDiGraph) -> tuple[csr_matrix, pd.Series]:
+    """
+    Function that converts the projected street network graph into a sparse matrix of edge lengths, so it can be routed with SciPy.
+
+    Returns a SciPy sparse matrix and a Pandas Series mapping graph node ids to matrix positions.
+    """
+    node_positions = pd.Series(np.arange(graph_proj.number_of_nodes()), index=list(graph_proj.nodes))
+
+    edges = pd.DataFrame(list(graph_proj.edges(data="length")), columns=["u", "v", "length"])
+
+    #Parallel edges between the same nodes are collapsed to the shortest, the same edge osmnx picks when drawing the route.
+    edges = edges.groupby(["u", "v"], as_index=False)["length"].min()
+
+    #Zero length edges are given a tiny length, as SciPy treats zero entries as missing edges.
+    lengths = np.maximum(edges["length"].to_numpy(dtype=np.float64), 1e-6)
+
+    matrix = csr_matrix(
+        (lengths, (node_positions[edges["u"]].to_numpy(), node_positions[edges["v"]].to_numpy())),
+        shape=(len(node_positions), len(node_positions))
+    )
+
+    return matrix, node_positions
+
+def _route_pairs(node_pairs: list[tuple[int, int]], graph_proj: nx.MultiDiGraph) -> list[Union[BaseGeometry, None]]:
+    """
+    Function that finds the shortest road routes between pairs of nodes on the projected street network graph.
+
+    Returns a list of route geometries in the projected graph's CRS, with None where no route could be found.
+    """
+    matrix, node_positions = _build_routing_matrix(graph_proj)
+    node_ids = node_positions.index.to_numpy()
+
+    #Run Dijkstra once from each distinct origin, every destination's route can then be read from the predecessors.
+    origins = list(dict.fromkeys(orig_node for orig_node, _ in node_pairs))
+    origin_rows = {orig_node: i for i, orig_node in enumerate(origins)}
+
+    predecessors = dijkstra(matrix, directed=True, indices=node_positions[origins].to_numpy(), return_predecessors=True)[1]
+
+    routes = []
+
+    for orig_node, dest_node in node_pairs:
+        row = predecessors[origin_rows[orig_node]]
+        orig_position = node_positions[orig_node]
+        position = node_positions[dest_node]
+
+        #Walk back from the destination to the origin.
+        path = [position]
+        while position != orig_position and row[position] >= 0:
+            position = row[position]
+            path.append(position)
+
+        if position != orig_position:
+            routes.append(None)
+            continue
+
+        route_nodes = node_ids[path[::-1]].tolist()
+
+        try:
+            route_gdf = ox.routing.route_to_gdf(graph_proj, route_nodes, weight="length")
+            routes.append(unary_union(route_gdf.geometry))
+
+        except ValueError:
+            routes.append(None)
+
+    return routes
+
 def get_road_geometries(wkt_df: pd.DataFrame) -> gpd.GeoDataFrame:
     """
     Function that finds the shortest road route between two points in a multiline WKT used for traffic sensors in the UO API.
@@ -88,45 +263,71 @@ def get_road_geometries(wkt_df: pd.DataFrame) -> gpd.GeoDataFrame:
     Returns a GeoPandas GeoDataFrame of the geometries of the shortest route between the points.
     """
     #Load a street network graph for newcastle.
-    graph = ox.graph_from_place("Newcastle upon Tyne, UK", network_type="drive")
-    graph_proj = ox.project_graph(graph)
+    graph, graph_proj = _load_street_network()
     
     #Convert the WKT into geopandas geometry.
-    gSeries = gpd.GeoSeries.from_wkt(wkt_df["Location_WKT"])
-    
-    final_geometries = []
+    gSeries = gpd.GeoSeries.from_wkt(wkt_df["Location_WKT"], crs="EPSG:4326")
 
-    #Loops through the pairs of points and "draws" a route between them using the nodes on the graph.
-    for geometry in gSeries:
-        start_point = geometry.coords[0]
-        end_point = geometry.coords[-1]
+    #Find the graph nodes closest to the start and end of every sensor in one lookup each.
+    starts = np.array([geometry.coords[0] for geometry in gSeries])
+    ends = np.array([geometry.coords[-1] for geometry in gSeries])
 
-        orig_node = ox.nearest_nodes(graph, X=start_point[0], Y=start_point[1])
-        dest_node = ox.nearest_nodes(graph, X=end_point[0], Y=end_point[1])
+    orig_nodes = ox.distance.nearest_nodes(graph, X=starts[:, 0], Y=starts[:, 1])
+    dest_nodes = ox.distance.nearest_nodes(graph, X=ends[:, 0], Y=ends[:, 1])
 
-        try:
-            route_nodes = nx.shortest_path(graph_proj, orig_node, dest_node, weight="length")
-            
-            route_gdf = ox.routing.route_to_gdf(graph_proj, route_nodes, weight="length")
-            combined_line_proj = unary_union(route_gdf.geometry)
-            
-            combined_line_4326 = gpd.GeoSeries([combined_line_proj], crs=graph_proj.graph["crs"]).to_crs("EPSG:4326").iloc[0]
-            
-            final_geometries.append(combined_line_4326)
+    node_pairs = [(int(orig_node), int(dest_node)) for orig_node, dest_node in zip(orig_nodes, dest_nodes)]
+
+    #Sensors often share the same end nodes, so only route pairs that haven't already been routed.
+    new_pairs = list(dict.fromkeys(pair for pair in node_pairs if pair not in _route_cache))
+
+    #"Draw" all the new routes between the pairs of points using the nodes on the graph.
+    if new_pairs:
+        _route_cache.update(zip(new_pairs, _route_pairs(new_pairs, graph_proj)))
 
-        #If this fails, draw a straight line as the bird flies.    
-        except (nx.NetworkXNoPath, ValueError):
-            print(f"Routing failed, keeping original straight line.")
-            final_geometries.append(geometry)
+    routes_proj = [_route_cache[pair] for pair in node_pairs]
+
+    failed = np.array([route is None for route in routes_proj], dtype=bool)
+
+    #If routing failed, draw a straight line as the bird flies.
+    for _ in range(np.count_nonzero(failed)):
+        print(f"Routing failed, keeping original straight line.")
+
+    #Keep every geometry in both projections, reprojecting the routes and the straight lines in one go each rather than one at a time.
+    proj_crs = graph_proj.graph["crs"]
+
+    projected_geometries = np.empty(len(gSeries), dtype=object)
+    projected_geometries[~failed] = [route for route in routes_proj if route is not None]
+    projected_geometries[failed] = gSeries[failed].to_crs(proj_crs).to_numpy()
+
+    final_geometries = gSeries.to_numpy().copy()
+    final_geometries[~failed] = gpd.GeoSeries(projected_geometries[~failed], crs=proj_crs).to_crs("EPSG:4326").to_numpy()
 
     #Create the final geodataframe with the projection the rest of the code uses.
-    gdf = gpd.GeoDataFrame(wkt_df, geometry=final_geometries, crs="EPSG:4326")
+    gdf = gpd.GeoDataFrame(wkt_df, geometry=list(final_geometries), crs="EPSG:4326")
 
-    #Calculate the legnth of the routes.
-    gdf["road_length(m)"] = gdf.to_crs(gdf.estimate_utm_crs()).length
+    #Calculate the legnth of the routes, the graph is already projected in meters.
+    gdf["road_length(m)"] = gpd.GeoSeries(projected_geometries, crs=proj_crs).length.to_numpy()
     
     return gdf
 
+def prepare_wide_timeseries(long_df: pd.DataFrame, freq: str, start_datetime: datetime.datetime, end_datetime: datetime.datetime) -> pd.DataFrame:
+    """
+    Function that clips a long timeseries to a time period, resamples it to a given frequency and converts it to a wide dataframe.
+
+    Readings are clipped before resampling so that data outside the period is never aggregated or pivoted, keeping exactly the time bins that fall between the two datetimes.
+    Time bins are aligned to the epoch, so the clip and the resample agree for any frequency. For frequencies that divide a day this matches resampling the whole timeseries and then slicing, for others the bins may be offset from that.
+
+    Returns a Pandas DataFrame.
+    """
+    #Keep readings whose time bin starts within the period, ie from the first bin at or after the start up to the end of the bin containing the end.
+    #Rounding a timestamp to a frequency is relative to the epoch, so the bins must be too.
+    first_bin = pd.Timestamp(start_datetime).ceil(freq)
+    after_last_bin = pd.Timestamp(end_datetime).floor(freq) + pd.tseries.frequencies.to_offset(freq)
+
+    long_df = long_df[(long_df.index >= first_bin) & (long_df.index < after_last_bin)]
+
+    return convert_long_df_to_wide(resample_sensors_timeseries(long_df, freq, origin="epoch"))
+
 def clip_timeseries_by_variable(df: pd.DataFrame, variables: Union[str, List[str]]) -> pd.DataFrame:
     """
     Function that removes any sensors from the given DataFrame that do not have the variable(s) provided.
@@ -139,6 +340,14 @@ def clip_timeseries_by_variable(df: pd.DataFrame, variables: Union[str, List[str
 
     return df[df["Variable"].isin(variables)]
 
+def _to_column_major(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Function that rebuilds a numeric DataFrame on a Fortran ordered array, so each column is contiguous in memory for column-wise reductions.
+
+    Returns a Pandas DataFrame.
+    """
+    return pd.DataFrame(np.asfortranarray(df.to_numpy(dtype=np.float64)), index=df.index, columns=df.columns)
+
 def convert_long_df_to_wide(long_df: pd.DataFrame) -> pd.DataFrame:
     """
     Function that converts long datafrane with each reading on a new row into a wide dataframe with common timestamps on each row.
@@ -149,13 +358,25 @@ def convert_long_df_to_wide(long_df: pd.DataFrame) -> pd.DataFrame:
     long_df = long_df.copy()
 
     long_df = long_df.reset_index()
-    #Create a column name by combining the sensor name with the variable
-    long_df["Column_Name"] = long_df["Sensor_Name"] + "_" + long_df["Variable"]
 
-    #Construct the wide datframe with the column names
+    #Create an integer key for each sensor and variable combination from their category codes, rather than joining strings on every row.
+    sensors = long_df["Sensor_Name"].astype("category")
+    variables = long_df["Variable"].astype("category")
+    n_variables = len(variables.cat.categories)
+
+    long_df["Column_Name"] = sensors.cat.codes.to_numpy(dtype=np.int64) * n_variables + variables.cat.codes.to_numpy(dtype=np.int64)
+
+    #Construct the wide datframe with the integer keys
     wide_df = long_df.pivot(index = "Timestamp", columns= "Column_Name", values= "Value")
 
-    return wide_df
+    #Create a column name by combining the sensor name with the variable, only once per combination.
+    wide_df.columns = pd.Index(
+        [f"{sensors.cat.categories[key // n_variables]}_{variables.cat.categories[key % n_variables]}" for key in wide_df.columns],
+        name="Column_Name"
+    )
+    wide_df = wide_df.sort_index(axis=1)
+
+    return _to_column_major(wide_df)
 
 def create_correlation_matrix(wide_df: pd.DataFrame) -> pd.DataFrame:
     """
@@ -165,9 +386,48 @@ def create_correlation_matrix(wide_df: pd.DataFrame) -> pd.DataFrame:
 
     Returns a Pandas correlation DataFrame. 
     """
-    wind_columns = wide_df.filter(like="Wind Speed")
-    time_step_mean_wind  = wind_columns.mean(axis=1)
-    return wide_df[time_step_mean_wind < 3].corr()
+    columns = wide_df.columns
+    values = wide_df.to_numpy(dtype=np.float64)
+
+    #Work out which columns are wind speeds once, then average them on the raw array.
+    wind_mask = np.fromiter(("Wind Speed" in column for column in columns), dtype=bool, count=len(columns))
+    wind_values = values[:, wind_mask]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        time_step_mean_wind = np.nansum(wind_values, axis=1) / np.count_nonzero(~np.isnan(wind_values), axis=1)
+
+    calm_values = values[time_step_mean_wind < 3]
+
+    #Missing values have to be handled pair by pair, which only Pandas does, otherwise a single NumPy correlation covers every column at once.
+    if len(calm_values) < 2 or np.isnan(calm_values).any():
+        return _to_column_major(pd.DataFrame(calm_values, columns=columns)).corr()
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        corr = np.atleast_2d(np.corrcoef(calm_values, rowvar=False))
+
+    return pd.DataFrame(corr, index=columns, columns=columns)
+
+def _nan_column_quantiles(values: np.ndarray, quantiles: list[float]) -> np.ndarray:
+    """
+    Function that calculates quantiles of each column of an array, ignoring NaNs and interpolating linearly in the same way as Pandas.
+
+    Returns a NumPy array with a row per quantile and a column per column of the input.
+    """
+    #A single sort serves every quantile, NaNs are sorted to the end of each column.
+    sorted_values = np.sort(values, axis=0)
+    counts = np.count_nonzero(~np.isnan(values), axis=0)
+
+    positions = np.outer(quantiles, np.maximum(counts - 1, 0))
+    lower = np.floor(positions).astype(np.intp)
+    upper = np.ceil(positions).astype(np.intp)
+
+    lower_values = np.take_along_axis(sorted_values, lower, axis=0)
+    upper_values = np.take_along_axis(sorted_values, upper, axis=0)
+
+    result = lower_values + (upper_values - lower_values) * (positions - lower)
+    result[:, counts == 0] = np.nan
+
+    return result
 
 def clean_data(df: pd.DataFrame, freq: str, max_gap: int=24) -> pd.DataFrame:
     """
@@ -175,57 +435,90 @@ def clean_data(df: pd.DataFrame, freq: str, max_gap: int=24) -> pd.DataFrame:
 
     Returns a Pandas DataFrame.
     """
-    df = df.copy()
+    #Work on a single float array so each filter is one pass over memory rather than building a masked DataFrame.
+    #The copy is made column-major, as both filters work down each column.
+    values = np.array(df.to_numpy(dtype=np.float64), order="F")
 
     #Remove any negative values from the data as these are not valid.
-    negatives_mask = df < 0
-    negatives_count = negatives_mask.sum().sum()
-    df[negatives_mask] = np.nan
+    negatives_mask = values < 0
+    negatives_count = np.count_nonzero(negatives_mask)
+    values[negatives_mask] = np.nan
     print(f"Negative value filtering removed {negatives_count} values.")
 
     #Calculate outliers using interquartile range as standard deviation is too skewed by outliers.
-    Q1 = df.quantile(0.25)
-    Q3 = df.quantile(0.75)
+    Q1, Q3 = _nan_column_quantiles(values, [0.25, 0.75])
     IQR = Q3 - Q1
 
     lower_bound = Q1 - 3.0 * IQR
     upper_bound = Q3 + 3.0 * IQR
 
-    outlier_mask = (df < lower_bound) | (df > upper_bound)
-    outliers_count = outlier_mask.sum().sum()
+    outlier_mask = (values < lower_bound) | (values > upper_bound)
+    outliers_count = np.count_nonzero(outlier_mask)
 
-    df[outlier_mask] = np.nan
+    values[outlier_mask] = np.nan
 
     print(f"Outlier detection removed {outliers_count} values.")
 
+    df = pd.DataFrame(values, index=df.index, columns=df.columns)
+
     #Interpolate missing values over small gaps, but for signifcant gaps leave as NaN.
     full_idx = pd.date_range(start=df.index.min(), end=df.index.max(), freq=freq)
     df = df.reindex(full_idx)
     df.index.name = "Timestamp"
     original_nans = df.isna().sum().sum()
-    df = df.interpolate(method="time", limit=max_gap, limit_direction="both")
+    #The index is now evenly spaced, so linear interpolation gives the same result as time weighted interpolation without calculating time deltas.
+    df = df.interpolate(method="linear", limit=max_gap, limit_direction="both")
     remaining_nans = df.isna().sum().sum()
     nans_removed = original_nans - remaining_nans
     print(f"Cleaning removed {nans_removed} NaN values, {remaining_nans} remain.")
 
     return df
 
+#Columns of the archived UO data CSV files that are used in the analysis.
+ARCHIVE_COLUMNS = ["Timestamp", "Sensor Name", "Variable", "Value"]
+
+def _read_archive_csv(filepath: Path) -> pd.DataFrame:
+    """
+    Function that parses a CSV file of archived UO data.
+
+    Returns a Pandas DataFrame
+    """
+    #Only read the columns used later on, and store names as categories as they repeat on every row, so filtering and grouping compare integer codes rather than strings.
+    df = pd.read_csv(
+        filepath,
+        usecols=lambda column: column in ARCHIVE_COLUMNS,
+        dtype={"Sensor Name": "category", "Variable": "category"}
+    )
+    df["Timestamp"] = pd.to_datetime(df["Timestamp"], format="ISO8601", cache=True)
+    df = df.set_index("Timestamp")
+    df = df.rename(columns={"Sensor Name" : "Sensor_Name"})
+    df["Flagged"] = False
+
+    return df
+
 def import_archive_dataset(filepath: Path, sensors: list = []) -> pd.DataFrame:
     """
     Function that reads CSV files of archieved UO data, so API call doesn't need to be made every time script is run.
 
+    The parsed data is cached in a pickle file next to the CSV, which is used instead of the CSV until the CSV is changed.
+
     Returns a Pandas DataFrame
     """
     
     #This function was made as the length of data analysed in the report would take weeks at the rate the api responds to requests.
     #This could likely be solved with parrallellisation or a more customised requester, but this was beyond the scope of this assignment.
-    df = pd.read_csv(filepath, index_col="Timestamp")
-    df.index = pd.to_datetime(df.index)
-    df = df.rename(columns={"Sensor Name" : "Sensor_Name"})
-    df["Flagged"] = False
+    filepath = Path(filepath)
+    cache_path = filepath.with_suffix(".pkl")
+
+    if cache_path.exists() and cache_path.stat().st_mtime >= filepath.stat().st_mtime:
+        df = pd.read_pickle(cache_path)
+    else:
+        df = _read_archive_csv(filepath)
+        df.to_pickle(cache_path)
 
     if len(sensors) != 0:
         df = df[df["Sensor_Name"].isin(sensors)]
+        df = df.assign(Sensor_Name=df["Sensor_Name"].cat.remove_unused_categories())
 
     return df
 
@@ -260,10 +553,27 @@ def decompose_timeseries(index: pd.Index, data: pd.Series) -> pd.DataFrame:
 
     return results_df
 
-def get_valid_scenario_dates(df: pd.DataFrame, variable_suffix: str):
+class IndexView(NamedTuple):
+    """
+    Class that holds the calendar components of a DatetimeIndex as NumPy arrays, so they are only calculated once.
+    """
+    day_of_week: np.ndarray
+    hour: np.ndarray
+
+def get_index_view(index: pd.DatetimeIndex) -> IndexView:
+    """
+    Function that extracts the day of week and hour of every timestamp in an index.
+
+    Returns an IndexView.
+    """
+    return IndexView(day_of_week=index.dayofweek.to_numpy(), hour=index.hour.to_numpy())
+
+def get_valid_scenario_dates(df: pd.DataFrame, variable_suffix: str, index_view: Union[IndexView, None] = None):
     """
     Function that finds valid times to show rush hour air quality data, using rush hour and normal times obtained from decomposition analysis.
 
+    An IndexView of the dataframe's index can be passed in if it has already been calculated.
+
     Returns a datetime object.
     """
 
@@ -276,22 +586,29 @@ def get_valid_scenario_dates(df: pd.DataFrame, variable_suffix: str):
     #Use first value to check if not NaN
     check_col = relevant_cols[0]
 
+    #Get the day and hour of every timestamp once, and check for NaNs on the raw values.
+    if index_view is None:
+        index_view = get_index_view(df.index)
+
+    day_of_week = index_view.day_of_week
+    hour = index_view.hour
+    values = df[check_col].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(values)
+
     #Finds data at rush hour on a thursday
-    thurs_data = df[(df.index.dayofweek == 3) & (df.index.hour == 17)]
-    valid_thurs = thurs_data.dropna(subset=[check_col])
+    valid_thurs = (day_of_week == 3) & (hour == 17) & valid
 
-    if valid_thurs.empty:
+    if not valid_thurs.any():
         raise Exception("No valid data found for any Thursday at 17:00")
 
-    worst_case_date = valid_thurs[check_col].idxmax().to_pydatetime()
+    worst_case_date = df.index[np.argmax(np.where(valid_thurs, values, -np.inf))].to_pydatetime()
 
     #Finds data after rush hour on a monday
-    mon_data = df[(df.index.dayofweek == 0) & (df.index.hour == 10)]
-    valid_mon = mon_data.dropna(subset=[check_col])
+    valid_mon = (day_of_week == 0) & (hour == 10) & valid
 
-    if valid_mon.empty:
+    if not valid_mon.any():
         raise Exception("No valid data found for any Monday at 10:00")
 
-    comparison_date = valid_mon.index[0].to_pydatetime()
+    comparison_date = df.index[np.argmax(valid_mon)].to_pydatetime()
 
     return worst_case_date, comparison_date
\ No newline at end of file
@@ -1,78 +1,407 @@
+import base64
 import datetime
+import functools
+import hashlib
+import os
+import io
+
+import requests
 
 import pandas as pd
 import geopandas as gpd
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
 import numpy as np
-from scipy.interpolate import griddata
+import matplotlib.image as mpimg
+import shapely
+from scipy.spatial import cKDTree
 
 from shapely.geometry import Point
 from plotly.subplots import make_subplots
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+from typing import Union, Callable
+
+def _as_float_array(values) -> np.ndarray:
+    """
+    Function that converts trace data to a float array, decoding Plotly's base64 typed array form used when figures are rebuilt from dictionaries.
+
+    Returns a NumPy array.
+    """
 
-def save_figure(fig: go.Figure, name: str):
+    if isinstance(values, dict):
+        return np.frombuffer(base64.b64decode(values["bdata"]), dtype=values["dtype"]).astype(np.float64)
+
+    return np.asarray(values, dtype=np.float64)
+
+def _prepare_figure_for_export(fig: go.Figure, format: str, precision: Union[int, None]) -> go.Figure:
+    """
+    Function that rounds map coordinates on a copy of a figure before it is exported as a vector image.
+
+    Returns a Plotly Graph Objects Figure, which is the original figure if nothing needs rounding.
+    """
+
+    if format != "svg" or precision is None:
+        return fig
+
+    #Round a copy so the figure passed in is left untouched.
+    fig = go.Figure(fig)
+
+    for trace in fig.data:
+        if isinstance(trace, (go.Scattermapbox, go.Densitymapbox)):
+            if trace.lat is not None:
+                trace.lat = np.round(_as_float_array(trace.lat), precision)
+            if trace.lon is not None:
+                trace.lon = np.round(_as_float_array(trace.lon), precision)
+
+    return fig
+
+def save_figure(fig: go.Figure, name: str, format: str = "svg", scale: float = 3, precision: Union[int, None] = 4):
     """
     Function that saves a figure as a vector image, scaling any raster components.
+
+    Raster formats such as "png" or "webp" can be requested instead, which export much faster for maps with many points.
+    For vector images, map coordinates are rounded to precision decimal places to keep the file small, or left as they are if precision is None.
     """
-    
-    figure_directory = Path(f"outputs/figures/{name}.svg")
-    fig.write_image(figure_directory, format="svg", scale=3)
 
-def create_all_sensors_within_boundary_plot(sensor_locations: gpd.GeoDataFrame, boundary: gpd.GeoDataFrame) -> go.Figure:
+    fig = _prepare_figure_for_export(fig, format, precision)
+
+    figure_directory = Path(f"outputs/figures/{name}.{format}")
+    fig.write_image(figure_directory, format=format, scale=scale)
+
+def _build_and_save_figures(batch: tuple[list[tuple[Callable[..., go.Figure], tuple, str]], str, float, Union[int, None]]):
+    """
+    Function that builds a batch of figures from their figure functions and exports them through one Kaleido session, for use in worker processes.
+    """
+
+    jobs, format, scale, precision = batch
+
+    figures = [_prepare_figure_for_export(builder(*args), format, precision) for builder, args, _ in jobs]
+    paths = [Path(f"outputs/figures/{name}.{format}") for _, _, name in jobs]
+
+    #Writing the batch together reuses one browser instead of starting Kaleido for every figure
+    pio.write_images(figures, paths, format=format, scale=scale)
+
+def build_and_save_figures(jobs: list[tuple[Callable[..., go.Figure], tuple, str]], format: str = "svg", scale: float = 3, precision: Union[int, None] = 4):
+    """
+    Function that builds and saves many independent figures at once, splitting them between worker processes that each create their share of figures and export them through a single Kaleido session.
+
+    Each job is a figure function, the arguments to call it with and the name to save the figure under.
+    """
+
+    if not jobs:
+        return
+
+    n_workers = min(os.cpu_count() or 1, len(jobs))
+    batches = [(jobs[worker::n_workers], format, scale, precision) for worker in range(n_workers)]
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        list(executor.map(_build_and_save_figures, batches))
+
+#Folder the basemap tiles are saved to, so each tile is only downloaded once.
+BASEMAP_DIR = Path("outputs/basemap")
+
+#Size in pixels that figures are exported at when no size is set, which the basemap has to cover.
+BASEMAP_VIEW_SIZE = (700, 500)
+
+#Seconds to wait to connect to the tile server, and then for it to send a tile.
+BASEMAP_TIMEOUT = (3.05, 30)
+
+def _lon_lat_to_world(lon: float, lat: float) -> tuple[float, float]:
+    """
+    Function that finds the position of a point in web mercator, as a fraction of the width and height of the world.
+
+    Returns the x and y fractions, from the top left corner.
+    """
+    x = (lon + 180) / 360
+    y = (1 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2
+    return float(x), float(y)
+
+def _tile_to_lon_lat(x: int, y: int, zoom: int) -> tuple[float, float]:
+    """
+    Function that finds the top left corner of a web mercator map tile.
+
+    Returns the longitude and latitude of the corner.
+    """
+    n = 2 ** zoom
+    lon = x / n * 360 - 180
+    lat = float(np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y / n)))))
+    return lon, lat
+
+@functools.lru_cache(maxsize=8)
+def get_basemap_layers(center_lon: float, center_lat: float, zoom: float, width: int = BASEMAP_VIEW_SIZE[0], height: int = BASEMAP_VIEW_SIZE[1]) -> tuple:
+    """
+    Function that creates a static OpenStreetMap background covering a map view, downloading the tiles to disk only the first time they are needed.
+
+    The view is given by the map centre and zoom, and the figure size in pixels. Tiles are taken from the zoom level that matches the detail of the view.
+    Using cached image layers stops every map figure from fetching the same tiles again when it is rendered.
+
+    Returns a tuple of Plotly mapbox layer dictionaries, one for each tile.
+    """
+    #Mapbox views are 512 pixels wide per world at zoom 0, and OpenStreetMap tiles are 256 pixels, so one zoom level higher gives the same detail.
+    tile_zoom = int(np.clip(np.ceil(zoom) + 1, 0, 19))
+    n = 2 ** tile_zoom
+
+    #Find the edges of the view as fractions of the world.
+    world_pixels = 512 * 2 ** zoom
+    center_x, center_y = _lon_lat_to_world(center_lon, center_lat)
+    half_width = width / 2 / world_pixels
+    half_height = height / 2 / world_pixels
+
+    x_min = int(np.floor((center_x - half_width) * n))
+    x_max = int(np.floor((center_x + half_width) * n))
+    y_min = max(int(np.floor((center_y - half_height) * n)), 0)
+    y_max = min(int(np.floor((center_y + half_height) * n)), n - 1)
+
+    BASEMAP_DIR.mkdir(parents=True, exist_ok=True)
+
+    layers = []
+    for x in range(x_min, x_max + 1):
+        for y in range(y_min, y_max + 1):
+            tile_path = BASEMAP_DIR / f"{tile_zoom}_{x}_{y}.png"
+
+            if not tile_path.exists():
+                response = requests.get(
+                    f"https://tile.openstreetmap.org/{tile_zoom}/{x}/{y}.png",
+                    headers={"User-Agent": "CEG8006Coursework"},
+                    timeout=BASEMAP_TIMEOUT
+                )
+                if not response.ok:
+                    raise ValueError(f"Bad HTTP Response: Status Code {response.status_code}")
+                #Write to a temporary file first, so a figure built in another process never reads a half written tile.
+                partial_path = tile_path.with_suffix(f".{os.getpid()}.part")
+                partial_path.write_bytes(response.content)
+                os.replace(partial_path, tile_path)
+
+            encoded = base64.b64encode(tile_path.read_bytes()).decode()
+
+            #Each tile covers the area between its own top left corner and the top left corner of the next tile diagonally.
+            west_edge, north_edge = _tile_to_lon_lat(x, y, tile_zoom)
+            east_edge, south_edge = _tile_to_lon_lat(x + 1, y + 1, tile_zoom)
+
+            layers.append({
+                "sourcetype": "image",
+                "source": f"data:image/png;base64,{encoded}",
+                "coordinates": [[west_edge, north_edge], [east_edge, north_edge], [east_edge, south_edge], [west_edge, south_edge]],
+                "below": "traces"
+            })
+
+    return tuple(layers)
+
+#Coordinate arrays of the most recently drawn lines, keeping at most LINE_COORDINATE_CACHE_SIZE sets.
+LINE_COORDINATE_CACHE_SIZE = 16
+_line_coordinate_cache = OrderedDict()
+
+def _get_line_coordinates(geometries: np.ndarray, simplify_tolerance: Union[float, None] = None, preserve_topology: bool = False) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Function that flattens (multi)line geometries into coordinate arrays, with a NaN between each line so Plotly draws them separately.
+
+    Lines are simplified to simplify_tolerance degrees first, or used in full if it is None.
+    Results are cached by the WKB of the original geometries and the simplification settings, so redrawing the same boundary or roads skips both the simplification and the Shapely traversal.
+
+    Returns NumPy arrays of longitudes and latitudes.
+    """
+    digest = hashlib.blake2b(b"".join(shapely.to_wkb(geometries)))
+    digest.update(repr((simplify_tolerance, preserve_topology)).encode())
+    key = digest.digest()
+
+    if key in _line_coordinate_cache:
+        _line_coordinate_cache.move_to_end(key)
+    else:
+        if simplify_tolerance is not None:
+            geometries = shapely.simplify(geometries, simplify_tolerance, preserve_topology=preserve_topology)
+
+        #Split any multi part geometries into their individual lines, then pull every coordinate out in one call.
+        parts = shapely.get_parts(geometries)
+        coords, part_index = shapely.get_coordinates(parts, return_index=True)
+
+        #Shift each coordinate along by the number of line breaks before it, leaving NaN gaps in a buffer sized once.
+        new_line = np.diff(part_index, prepend=part_index[:1]) != 0
+        positions = np.arange(len(coords)) + np.cumsum(new_line)
+
+        #Single precision is accurate to well under a metre here and lets Plotly send half as many bytes
+        lons = np.full(len(coords) + new_line.sum(), np.nan, dtype=np.float32)
+        lats = np.full(len(coords) + new_line.sum(), np.nan, dtype=np.float32)
+        lons[positions] = coords[:, 0]
+        lats[positions] = coords[:, 1]
+
+        #Stop callers from changing the cached arrays in place
+        lons.flags.writeable = False
+        lats.flags.writeable = False
+
+        _line_coordinate_cache[key] = (lons, lats)
+        if len(_line_coordinate_cache) > LINE_COORDINATE_CACHE_SIZE:
+            _line_coordinate_cache.popitem(last=False)
+
+    return _line_coordinate_cache[key]
+
+def _hash_argument(value) -> tuple:
+    """
+    Function that creates a cache key for a figure function argument, hashing the contents of dataframes, series, arrays and geometries.
+
+    Any other argument must be hashable, and is used as its own key.
+
+    Returns the key as a tuple of the argument type and its hash or value.
+    """
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest = hashlib.blake2b(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+        if isinstance(value, pd.DataFrame):
+            digest.update(repr(list(value.columns)).encode())
+        return (type(value).__name__, digest.digest())
+
+    #Array reprs are truncated, so hash the full contents along with what they mean.
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            raise TypeError("Object arrays can't be used as cached figure arguments")
+        digest = hashlib.blake2b(np.ascontiguousarray(value).tobytes())
+        digest.update(repr((value.dtype.str, value.shape)).encode())
+        return ("ndarray", digest.digest())
+
+    if isinstance(value, shapely.Geometry):
+        return ("Geometry", hashlib.blake2b(shapely.to_wkb(value)).digest())
+
+    #Raises a TypeError for anything unhashable, rather than risking two different values sharing a key.
+    hash(value)
+    return (type(value).__name__, value)
+
+#Number of figures kept for each cached figure function, as each can hold several megabytes of data and basemap tiles.
+FIGURE_CACHE_SIZE = 4
+
+def _cache_figure(function):
+    """
+    Function that wraps a figure function so calls with unchanged inputs reuse the figure built the first time.
+
+    Only the FIGURE_CACHE_SIZE most recently used figures are kept. Each call gets its own copy of the cached figure, so callers are free to change it.
+    """
+
+    cache = OrderedDict()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        key = (
+            tuple(_hash_argument(arg) for arg in args),
+            tuple((name, _hash_argument(arg)) for name, arg in sorted(kwargs.items()))
+        )
+
+        if key in cache:
+            cache.move_to_end(key)
+        else:
+            cache[key] = function(*args, **kwargs)
+            if len(cache) > FIGURE_CACHE_SIZE:
+                cache.popitem(last=False)
+
+        return go.Figure(cache[key])
+
+    return wrapper
+
+def _cluster_points(lons: np.ndarray, lats: np.ndarray, cluster_size: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Function that groups points into square grid cells of cluster_size degrees, placing each cluster at the mean position of its points.
+
+    Returns NumPy arrays of cluster longitudes, latitudes and point counts.
+    """
+
+    cells = np.column_stack((np.floor(lons / cluster_size), np.floor(lats / cluster_size)))
+    _, cluster_index, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    cluster_index = cluster_index.ravel()
+
+    cluster_lons = np.bincount(cluster_index, weights=lons) / counts
+    cluster_lats = np.bincount(cluster_index, weights=lats) / counts
+
+    return cluster_lons, cluster_lats, counts
+
+def _create_sensor_traces(sensor_locations: gpd.GeoDataFrame, broker_names: Union[dict, None] = None, legend_label: str = "Broker_Name", marker_size: Union[int, None] = None, cluster_size: Union[float, None] = None) -> list[go.Scattermapbox]:
+    """
+    Function that creates one marker trace per broker in the order they first appear, coloured from the default Plotly palette.
+
+    If cluster_size is given, sensors of the same broker within the same grid cell of that many degrees are drawn as one marker scaled by the number of sensors.
+
+    Returns a list of Plotly Scattermapbox traces.
+    """
+
+    #Read every point's coordinates in one call rather than walking the geometries for x and again for y
+    coords = shapely.get_coordinates(sensor_locations.geometry.values)
+    lons = coords[:, 0]
+    lats = coords[:, 1]
+    #Rename only the distinct broker names, then map each sensor to its display name through the integer codes
+    #Missing broker names get their own code rather than -1, which would index the last broker, and are shown as "Unknown"
+    codes, raw_brokers = pd.factorize(sensor_locations["Broker_Name"], use_na_sentinel=False)
+    display_names = np.array(["Unknown" if pd.isna(broker) else (broker_names or {}).get(broker, broker) for broker in raw_brokers], dtype=object)
+    brokers = display_names[codes]
+
+    palette = px.colors.qualitative.Plotly
+
+    traces = []
+    for i, broker in enumerate(pd.unique(display_names)):
+        mask = brokers == broker
+
+        if cluster_size is None:
+            traces.append(go.Scattermapbox(
+                lat=lats[mask],
+                lon=lons[mask],
+                mode="markers",
+                marker=dict(color=palette[i % len(palette)], size=marker_size),
+                name=broker,
+                legendgroup=broker,
+                showlegend=True,
+                hovertemplate=f"{legend_label}={broker}<br>lat=%{{lat}}<br>lon=%{{lon}}<extra></extra>"
+            ))
+            continue
+
+        cluster_lons, cluster_lats, counts = _cluster_points(lons[mask], lats[mask], cluster_size)
+
+        #Grow marker area in proportion to the number of sensors, so a single sensor keeps the normal size
+        traces.append(go.Scattermapbox(
+            lat=cluster_lats,
+            lon=cluster_lons,
+            mode="markers",
+            marker=dict(color=palette[i % len(palette)], size=(marker_size or 6) * np.sqrt(counts)),
+            customdata=counts,
+            name=broker,
+            legendgroup=broker,
+            showlegend=True,
+            hovertemplate=f"{legend_label}={broker}<br>Sensors=%{{customdata}}<br>lat=%{{lat}}<br>lon=%{{lon}}<extra></extra>"
+        ))
+
+    return traces
+
+@_cache_figure
+def create_all_sensors_within_boundary_plot(sensor_locations: gpd.GeoDataFrame, boundary: gpd.GeoDataFrame, simplify_tolerance: Union[float, None] = 0.0005, cluster_size: Union[float, None] = 0.01) -> go.Figure:
     """
     Function that creates a plot of sensors within the boundary polygon.
 
+    The boundary is simplified to simplify_tolerance degrees (about 50m by default) since finer detail is not visible at this zoom, or drawn in full if it is None.
+    Sensors are clustered into grid cells of cluster_size degrees (about 1km by default) so overlapping markers are drawn once, or plotted individually if it is None.
+
     Returns a Plotly Graph Objects Figure.
     """
     
-    sensor_locations = sensor_locations.copy()
-    boundary = boundary.copy()
-
     names_dict = {
         "NE Travel Data API" : "Traffic Data",
         "aq_mesh_api" : "Air Quality Data"
     }
     
-    sensor_locations["Broker_Name"] = sensor_locations["Broker_Name"].replace(names_dict)
-    
-    sensor_locations["lat"] = sensor_locations.geometry.y
-    sensor_locations["lon"] = sensor_locations.geometry.x
-
-    proj_boundary = boundary.to_crs(epsg=27700)
-
-    #Calculates a mid point to focus the view on from the centre of sensor locations.
-    mid_point = proj_boundary.geometry.centroid.iloc[0]
-    mid_point = gpd.GeoSeries([mid_point], crs=27700).to_crs(epsg=4326).iloc[0]
-    map_center = {"lat": mid_point.y, "lon": mid_point.x}
+    #Centre the view on the middle of the boundary extent, which avoids reprojecting the whole polygon.
+    min_lon, min_lat, max_lon, max_lat = boundary.total_bounds
+    map_center = {"lat": (min_lat + max_lat) / 2, "lon": (min_lon + max_lon) / 2}
     
     #Add the sensors as points
-    fig = px.scatter_mapbox(
-        sensor_locations, 
-        lat="lat", 
-        lon="lon", 
-        mapbox_style="open-street-map",
-        color="Broker_Name",
-        zoom=9.7,
-        center=map_center,
-        labels={
-            "Broker_Name" : "Type of Sensor",
-        },
-        title= "Map of Air Quality and Traffic Sensors within Newcastle Upon-Tyne"
+    fig = go.Figure(
+        data=_create_sensor_traces(sensor_locations, names_dict, "Type of Sensor", marker_size=15, cluster_size=cluster_size),
+        layout=dict(
+            mapbox=dict(style="white-bg", zoom=9.7, center=map_center),
+            legend=dict(title=dict(text="Type of Sensor"), tracegroupgap=0),
+            title=dict(text="Map of Air Quality and Traffic Sensors within Newcastle Upon-Tyne")
+        )
     )
 
-    fig.update_traces(marker={'size': 15})
+    #Outline the exterior of every polygon in the boundary.
+    boundary_rings = shapely.get_exterior_ring(shapely.get_parts(boundary.geometry.values))
+    boundary_lons, boundary_lats = _get_line_coordinates(boundary_rings, simplify_tolerance, preserve_topology=True)
 
-    boundary_lons = []
-    boundary_lats = []
-
-    parts = boundary.geometry.exterior
-
-    for part in parts:
-        x, y = part.xy
-        boundary_lons.extend(list(x) + [None])
-        boundary_lats.extend(list(y) + [None])
-            
     #Add the boundary as lines        
     fig.add_trace(go.Scattermapbox(
         mode="lines",
@@ -85,31 +414,30 @@ def create_all_sensors_within_boundary_plot(sensor_locations: gpd.GeoDataFrame,
         hoverinfo="skip"
     ))
 
+    fig.update_layout(mapbox_layers=list(get_basemap_layers(map_center["lon"], map_center["lat"], 9.7)))
+
     return fig
 
-def create_road_link_plot(road_geom: gpd.GeoDataFrame) -> go.Figure:
+@_cache_figure
+def create_road_link_plot(road_geom: gpd.GeoDataFrame, simplify_tolerance: Union[float, None] = 0.0002) -> go.Figure:
     """
     Function that creates a plot of road links between traffic sensors.
 
+    Road lines are simplified to simplify_tolerance degrees (about 20m by default), or drawn in full if it is None.
+
     Returns a Plotly Graph Objects Figure.
     """ 
     
     
     fig = go.Figure()
 
-    lats = []
-    lons = []
+    #Routes may already be split into several rows of single lines, so count the sensors rather than the rows.
+    n = road_geom["Sensor_Name"].nunique()
 
-    n = len(road_geom)
+    road_lines = road_geom.geometry.values
 
-    #For each geometry, create a list of points to draw lines through 
-    for multi_line in road_geom.geometry:
-        for line in multi_line.geoms:
-            x, y = line.xy
-            lats.extend(y)
-            lons.extend(x)
-            lats.append(None)
-            lons.append(None)
+    #For each geometry, create arrays of points to draw lines through 
+    lons, lats = _get_line_coordinates(road_lines, simplify_tolerance)
 
     #Add the points as lines
     fig.add_trace(go.Scattermapbox(
@@ -123,10 +451,11 @@ def create_road_link_plot(road_geom: gpd.GeoDataFrame) -> go.Figure:
 
     #Update centre of map and zoom
     fig.update_layout(
-        mapbox_style="open-street-map",
+        mapbox_style="white-bg",
         mapbox=dict(
             center=dict(lat=54.983, lon=-1.6178),
-            zoom=11
+            zoom=11,
+            layers=list(get_basemap_layers(-1.6178, 54.983, 11))
         ),
         title=f"Closest {n} Traffic Sensor Routes"
     )
@@ -140,67 +469,44 @@ def create_air_quality_sensor_location_plot(sensor_locations: gpd.GeoDataFrame)
     Returns a Plotly Graph Objects Figure.
     """
     
-    sensor_locations = sensor_locations.copy()
-    
     n = len(sensor_locations)
 
-    sensor_locations["lat"] = sensor_locations.geometry.y
-    sensor_locations["lon"] = sensor_locations.geometry.x
-
-    fig = px.scatter_mapbox(
-        sensor_locations,
-        lat="lat",
-        lon="lon", 
-        mapbox_style="open-street-map",
-        color="Broker_Name",
-        zoom=10,
-        center=dict(lat=54.983, lon=-1.6178),
-        title= f"Map of {n} Closest Air Quality Sensors"
+    fig = go.Figure(
+        data=_create_sensor_traces(sensor_locations),
+        layout=dict(
+            mapbox=dict(style="open-street-map", zoom=10, center=dict(lat=54.983, lon=-1.6178)),
+            legend=dict(title=dict(text="Broker_Name"), tracegroupgap=0),
+            title=dict(text=f"Map of {n} Closest Air Quality Sensors")
+        )
     )
 
     return fig
 
-def create_air_quality_road_links_site_location_plot(sensor_locations: gpd.GeoDataFrame, road_geom: gpd.GeoDataFrame, building_location: Point):
+def create_air_quality_road_links_site_location_plot(sensor_locations: gpd.GeoDataFrame, road_geom: gpd.GeoDataFrame, building_location: Point, simplify_tolerance: Union[float, None] = 0.0001):
     """
     Function that creates a plot of sensors, road links and a building location.
 
+    Road lines are simplified to simplify_tolerance degrees (about 10m by default), or drawn in full if it is None.
+
     Returns a Plotly Graph Objects Figure.
     """
     
-    sensor_locations = sensor_locations.copy()
-    road_geom = road_geom.copy()
-
-    sensor_locations["lat"] = sensor_locations.geometry.y
-    sensor_locations["lon"] = sensor_locations.geometry.x
-
     names_dict = {
         "aq_mesh_api" : "Air Quality Data"
     }
 
-    sensor_locations["Broker_Name"] = sensor_locations["Broker_Name"].replace(names_dict)
-    
-    fig = px.scatter_mapbox(
-        sensor_locations, 
-        lat="lat", 
-        lon="lon", 
-        mapbox_style="open-street-map",
-        color="Broker_Name",
-        zoom=11.5,
-        center=dict(lat=54.983, lon=-1.6178),
-        title= "Map of Air Quality and Traffic Sensors Around the Proposed Site",
-        labels= {"Broker_Name" : "Type of Sensor"}
+    fig = go.Figure(
+        data=_create_sensor_traces(sensor_locations, names_dict, "Type of Sensor"),
+        layout=dict(
+            mapbox=dict(style="white-bg", zoom=11.5, center=dict(lat=54.983, lon=-1.6178)),
+            legend=dict(title=dict(text="Type of Sensor"), tracegroupgap=0),
+            title=dict(text="Map of Air Quality and Traffic Sensors Around the Proposed Site")
+        )
     )
 
-    lats = []
-    lons = []
+    road_lines = road_geom.geometry.values
 
-    for multi_line in road_geom.geometry:
-        for line in multi_line.geoms:
-            x, y = line.xy
-            lats.extend(y)
-            lons.extend(x)
-            lats.append(None)
-            lons.append(None)
+    lons, lats = _get_line_coordinates(road_lines, simplify_tolerance)
 
     fig.add_trace(go.Scattermapbox(
         lat=lats,
@@ -222,29 +528,67 @@ def create_air_quality_road_links_site_location_plot(sensor_locations: gpd.GeoDa
         text=["Proposed Site Location"],
         showlegend=True
     ))
+
+    fig.update_layout(mapbox_layers=list(get_basemap_layers(-1.6178, 54.983, 11.5)))
     
     return fig
 
+@_cache_figure
 def create_correlation_heatmap(corr_df: pd.DataFrame) -> go.Figure:
     """
     Function that creates a heatmap showing how correlated sensors and their variables are with each other.
 
+    The matrix is drawn as one PNG image with correlations quantised to 256 levels, rather than sent as a grid of numbers.
+
     Returns a Plotly Graph Objects Figure.
     """
     
     clean_df = corr_df.dropna(axis=0, how="all").dropna(axis=1, how="all")
-    
+
+    #Label every feature for small matrices, but thin the labels to about 30 per axis for large ones
+    dtick = max(1, clean_df.shape[0] // 30)
+
+    #Quantise correlations from [-1, 1] onto 0 to 255 and colour them through a lookup table of the red, yellow, green scale
+    values = clean_df.to_numpy(dtype=np.float64)
+    missing = np.isnan(values)
+    levels = np.rint((np.clip(np.nan_to_num(values), -1, 1) + 1) * 127.5).astype(np.uint8)
+
+    scale_positions = np.linspace(0, 1, 256)
+    colour_lookup = np.column_stack([
+        np.interp(scale_positions, [0, 0.5, 1], [255, 255, 0]),
+        np.interp(scale_positions, [0, 0.5, 1], [0, 255, 128]),
+        np.interp(scale_positions, [0, 0.5, 1], [0, 0, 0]),
+        np.full(256, 255)
+    ]).astype(np.uint8)
+
+    image = colour_lookup[levels]
+    #Leave cells without a correlation transparent
+    image[missing, 3] = 0
+
     fig = px.imshow(
-        clean_df,
-        labels={
-            "x": "Features",
-            "y": "Features",
-            "color": "Correlation"
-        },
-        template="presentation",
-        color_continuous_scale=["red", "yellow", "green"],
-        range_color=[-1, 1]
+        image,
+        binary_string=True,
+        template="presentation"
     )
+
+    #Invisible trace so the correlation colour scale is still shown
+    fig.add_trace(go.Scatter(
+        x=[None],
+        y=[None],
+        mode="markers",
+        marker=dict(
+            color=[0],
+            colorscale=["red", "yellow", "green"],
+            cmin=-1,
+            cmax=1,
+            showscale=True,
+            colorbar={"title": {"text": "Correlation"}, "thickness": 30, "len": 1}
+        ),
+        hoverinfo="skip",
+        showlegend=False
+    ))
+
+    tick_positions = np.arange(0, clean_df.shape[0], dtick)
     
     fig.update_layout(
         width=1000,
@@ -254,20 +598,19 @@ def create_correlation_heatmap(corr_df: pd.DataFrame) -> go.Figure:
         title="Correlation Heatmap",
         xaxis={
             "automargin": True,
-            "tickmode": "linear",
-            "dtick": 1,
+            "tickmode": "array",
+            "tickvals": tick_positions,
+            "ticktext": clean_df.columns[tick_positions],
             "tickangle": -90,
             "tickfont": {"size": 10}
         },
         yaxis={
             "automargin": True,
-            "tickmode": "linear",
-            "dtick": 1,
-            "tickfont": {"size": 10}
-        },
-        coloraxis_colorbar={
-            "thickness": 30,
-            "len": 1
+            "tickmode": "array",
+            "tickvals": tick_positions,
+            "ticktext": clean_df.index[tick_positions],
+            "tickfont": {"size": 10},
+            "autorange": "reversed"
         }
     )
     
@@ -299,13 +642,20 @@ def create_decomposed_timeseries_plot(decomp_df: pd.DataFrame) -> go.Figure:
 
     for i, col in enumerate(found_periods):
         time_attr = known_periods[col][0]
-        
-        avg_profile = decomp_df[col].groupby(getattr(decomp_df.index, time_attr)).mean()
+
+        #Average each period value with bincount, skipping missing values and periods with no data
+        keys = getattr(decomp_df.index, time_attr).to_numpy()
+        values = decomp_df[col].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+
+        sums = np.bincount(keys[valid], weights=values[valid])
+        counts = np.bincount(keys[valid], minlength=len(sums))
+        periods = np.flatnonzero(counts)
         
         fig.add_trace(
             go.Scatter(
-                x=avg_profile.index,
-                y=avg_profile.values,
+                x=periods,
+                y=sums[periods] / counts[periods],
                 name=col + " Average",
                 mode="lines+markers",
                 line=dict(color="firebrick", width=2)
@@ -333,10 +683,13 @@ def create_decomposed_timeseries_plot(decomp_df: pd.DataFrame) -> go.Figure:
 
     return fig
 
-def create_decomposed_trend_plot(decomp_df: pd.DataFrame) -> go.Figure:
+@_cache_figure
+def create_decomposed_trend_plot(decomp_df: pd.DataFrame, webgl: bool = False) -> go.Figure:
     """
     Function that creates multiple plots of a timeseries decomposition, showing full decomposition and trend over the data time period.
 
+    Lines are drawn as vector paths by default so exported SVGs stay sharp, or with WebGL if webgl is True, which is faster for interactive viewing of long timeseries.
+
     Returns a Plotly Graph Objects Figure.
     """
     
@@ -351,9 +704,11 @@ def create_decomposed_trend_plot(decomp_df: pd.DataFrame) -> go.Figure:
         vertical_spacing=0.05
     )
 
+    trace_type = go.Scattergl if webgl else go.Scatter
+
     for i, col in enumerate(cols):
         fig.add_trace(
-            go.Scatter(
+            trace_type(
                 x=decomp_df.index, 
                 y=decomp_df[col], 
                 name=col,
@@ -386,73 +741,69 @@ def create_air_polution_heatmap(air_quality_timseries: pd.DataFrame, air_quality
     #Get requested data
     data_row = air_quality_timseries.loc[target_datetime]
     suffix = f"_{variable}"
-    relevant_cols = [col for col in data_row.index if col.endswith(suffix)]
+    is_relevant = data_row.index.str.endswith(suffix)
 
-    if not relevant_cols:
+    if not is_relevant.any():
         raise ValueError(f"No columns found ending with \"{suffix}\"")
 
-    parsed_data = []
-    for col in relevant_cols:
-        sensor_name = col.rsplit("_", 1)[0]
-        value = data_row[col]
-        parsed_data.append({"Sensor_Name": sensor_name, "Value": value})
-
-    df_values = pd.DataFrame(parsed_data)
+    #Look up each sensor location directly instead of merging dataframes
+    sensor_coords = shapely.get_coordinates(air_quality_sensors.geometry.values)
+    sensor_rows = dict(zip(air_quality_sensors["Sensor_Name"], range(len(sensor_coords))))
 
-    merged_df = df_values.merge(air_quality_sensors, on="Sensor_Name", how="inner")
-    merged_df = gpd.GeoDataFrame(merged_df, geometry="geometry")
-    merged_df = merged_df.dropna(subset=["Value"])
+    #Strip the variable suffix from every column name at once to get the sensor names
+    names = data_row.index[is_relevant].str.slice(stop=-len(suffix)).to_numpy(dtype=object)
+    values = data_row.to_numpy(dtype=np.float64)[is_relevant]
+    mask = ~np.isnan(values) & np.array([name in sensor_rows for name in names], dtype=bool)
 
-    if merged_df.empty:
+    if not mask.any():
         raise ValueError("No matching sensor data found after merging and cleaning.")
 
-    merged_df["lat"] = merged_df.geometry.y
-    merged_df["lon"] = merged_df.geometry.x
+    names = names[mask]
+    values = values[mask]
+    lons, lats = sensor_coords[[sensor_rows[name] for name in names]].T
 
     #Create a grid to place interpolated values onto to avoid no data gaps between sensors
     grid_x, grid_y = np.mgrid[
-        merged_df["lon"].min()-0.01 : merged_df["lon"].max()+0.01 : 100j,
-        merged_df["lat"].min()-0.01 : merged_df["lat"].max()+0.01 : 100j
+        lons.min()-0.01 : lons.max()+0.01 : 100j,
+        lats.min()-0.01 : lats.max()+0.01 : 100j
     ]
 
-    #Set the values on the grid as linear interpolation from values at sensor points
-    grid_z = griddata(
-        points=(merged_df["lon"], merged_df["lat"]),
-        values=merged_df["Value"],
-        xi=(grid_x, grid_y),
-        method="linear"
+    #Set the values on the grid as inverse distance weighted averages of the nearest sensors
+    tree = cKDTree(np.column_stack((lons, lats)))
+    distances, indices = tree.query(
+        np.column_stack((grid_x.ravel(), grid_y.ravel())),
+        k=[*range(1, min(4, len(values)) + 1)]
     )
+    #Single precision is plenty for an 8 bit image and halves the size of the 10,000 cell working arrays
+    weights = 1 / (distances.astype(np.float32) ** 2 + np.float32(1e-12))
+    grid_z = ((weights * values.astype(np.float32)[indices]).sum(axis=1) / weights.sum(axis=1)).reshape(grid_x.shape)
 
-    flat_lon = grid_x.flatten()
-    flat_lat = grid_y.flatten()
-    flat_val = grid_z.flatten()
+    #Render the grid as one coloured image rather than thousands of density points
+    buffer = io.BytesIO()
+    mpimg.imsave(buffer, grid_z.T[::-1], cmap="RdYlGn_r", vmin=0, vmax=80, format="png")
+    encoded = base64.b64encode(buffer.getvalue()).decode()
 
-    mask = ~np.isnan(flat_val)
-    flat_lon = flat_lon[mask]
-    flat_lat = flat_lat[mask]
-    flat_val = flat_val[mask]
+    lon_min, lon_max = grid_x[0, 0], grid_x[-1, 0]
+    lat_min, lat_max = grid_y[0, 0], grid_y[0, -1]
 
     fig = go.Figure()
 
-    fig.add_trace(go.Densitymapbox(
-        lat=flat_lat,
-        lon=flat_lon,
-        z=flat_val,
-        radius=15,
-        colorscale="RdYlGn_r",
-        opacity=0.7,
-        zmin=0,
-        zmax=80,
+    #Invisible trace so the colour scale of the image is still shown
+    fig.add_trace(go.Scattermapbox(
+        lat=[None],
+        lon=[None],
+        mode="markers",
+        marker=dict(color=[0], colorscale="RdYlGn_r", cmin=0, cmax=80, showscale=True),
         hoverinfo="skip"
     ))
 
     fig.add_trace(go.Scattermapbox(
-        lat=merged_df["lat"],
-        lon=merged_df["lon"],
+        lat=lats,
+        lon=lons,
         mode="markers",
         marker=dict(size=10, color="black", symbol="circle"),
-        text=merged_df["Sensor_Name"],
-        hovertext=merged_df["Value"].apply(lambda x: f"{x:.2f}"),
+        text=names,
+        hovertext=[f"{value:.2f}" for value in values],
         hovertemplate="<b>%{text}</b><br>Value: %{hovertext}<extra></extra>"
     ))
 
@@ -460,8 +811,14 @@ def create_air_polution_heatmap(air_quality_timseries: pd.DataFrame, air_quality
         title=f"Interpolated {variable} - {target_datetime}",
         mapbox_style="open-street-map",
         mapbox=dict(
-            center=dict(lat=merged_df["lat"].mean(), lon=merged_df["lon"].mean()),
-            zoom=12
+            center=dict(lat=lats.mean(), lon=lons.mean()),
+            zoom=12,
+            layers=[dict(
+                sourcetype="image",
+                source=f"data:image/png;base64,{encoded}",
+                coordinates=[[lon_min, lat_max], [lon_max, lat_max], [lon_max, lat_min], [lon_min, lat_min]],
+                opacity=0.7
+            )]
         ),
         margin={"r": 0, "t": 40, "l": 0, "b": 0},
         showlegend=False
@@ -479,17 +836,15 @@ def create_sensor_boxplots(air_quality_timeseries: pd.DataFrame, sensor_name: st
     fig = go.Figure()
     
     prefix = f"{sensor_name}_"
-    relevant_cols = [col for col in air_quality_timeseries.columns if col.startswith(prefix)]
+    columns = air_quality_timeseries.columns
+    relevant_cols = columns[columns.str.startswith(prefix)]
+    variable_labels = relevant_cols.str.slice(len(prefix))
     
     #Dont show wind data
     excluded_vars = ["Wind Speed", "Wind Direction"]
+    keep = ~variable_labels.isin(excluded_vars)
 
-    for col in relevant_cols:
-        variable_label = col[len(prefix):]
-        
-        if variable_label in excluded_vars:
-            continue
-        
+    for col, variable_label in zip(relevant_cols[keep], variable_labels[keep]):
         fig.add_trace(go.Box(
             y=air_quality_timeseries[col],
             name=variable_label,
@@ -16,31 +16,32 @@ def main():
     newcastle_boundry = get_boundry_of_location("Newcastle upon Tyne")[["geometry"]]
 
     all_sensors = get_sensor_locations()
-    sensors_within_newcastle = all_sensors.sjoin(newcastle_boundry, "inner").drop(columns=["index_right"])
+    sensors_within_newcastle = filter_within_boundary(all_sensors, newcastle_boundry)
 
     sensors_to_use = ["NE Travel Data API", "aq_mesh_api"]
 
     relevant_sensors = filter_by_broker_name(sensors_within_newcastle, sensors_to_use)
 
-    fig = create_all_sensors_within_boundary_plot(relevant_sensors, newcastle_boundry)
-    save_figure(fig, "all_sensors_within_boundary")
+    #Figure builds are collected and run together at the end so they can be built and rendered in parallel
+    figure_jobs = []
+
+    figure_jobs.append((create_all_sensors_within_boundary_plot, (relevant_sensors, newcastle_boundry), "all_sensors_within_boundary"))
 
     air_quality_sensors = find_closest_sensors(relevant_sensors, new_building_location, "aq_mesh_api", 30)
     air_quality_sensor_locations = relevant_sensors[relevant_sensors["Sensor_Name"].isin(air_quality_sensors)]
 
-    fig = create_air_quality_sensor_location_plot(air_quality_sensor_locations)
-    save_figure(fig, "air_quality_sensors")
+    figure_jobs.append((create_air_quality_sensor_location_plot, (air_quality_sensor_locations,), "air_quality_sensors"))
 
     vehicle_sensors = find_closest_sensors(relevant_sensors, new_building_location, "NE Travel Data API", 20)
 
-    roads = get_sensors_wkt(vehicle_sensors)
+    roads = get_sensors_wkt(vehicle_sensors, all_sensors)
     road_geometries = get_road_geometries(roads)
+    #Split the routes into single lines once here, rather than inside every plot that draws them.
+    road_lines = road_geometries.explode(index_parts=False, ignore_index=True)
 
-    fig = create_road_link_plot(road_geometries)
-    save_figure(fig, "traffic_routes")
+    figure_jobs.append((create_road_link_plot, (road_lines,), "traffic_routes"))
 
-    fig = create_air_quality_road_links_site_location_plot(air_quality_sensor_locations, road_geometries, new_building_location)
-    save_figure(fig, "sensors_roads_building")
+    figure_jobs.append((create_air_quality_road_links_site_location_plot, (air_quality_sensor_locations, road_lines, new_building_location), "sensors_roads_building"))
 
     data_start = datetime.datetime(2023,5,5)
     data_end = datetime.datetime.now()
@@ -49,48 +50,40 @@ def main():
 
     traffic_timeseries = import_archive_dataset(Path("outputs/data/traffic.csv"), vehicle_sensors)
     
-    air_quality_timeseries = resample_sensors_timeseries(air_quality_timeseries, "1h")
-    traffic_timeseries = resample_sensors_timeseries(traffic_timeseries, "1h")
-
-    air_quality_timeseries = convert_long_df_to_wide(air_quality_timeseries)[data_start:data_end]
-    traffic_timeseries = convert_long_df_to_wide(traffic_timeseries)[data_start:data_end]
+    air_quality_timeseries = prepare_wide_timeseries(air_quality_timeseries, "1h", data_start, data_end)
+    traffic_timeseries = prepare_wide_timeseries(traffic_timeseries, "1h", data_start, data_end)
 
     combined_df = pd.concat([air_quality_timeseries, traffic_timeseries], axis=1)
     combined_df = clean_data(combined_df, "1h")
     corr_df = create_correlation_matrix(combined_df)
     
-    fig = create_correlation_heatmap(corr_df)
-    save_figure(fig, "corr_heatmap")
+    figure_jobs.append((create_correlation_heatmap, (corr_df,), "corr_heatmap"))
 
-    fig = create_air_quality_road_links_site_location_plot(air_quality_sensor_locations[air_quality_sensor_locations['Sensor_Name'] == 'PER_AIRMON_MONITOR1157100'], road_geometries[road_geometries['Sensor_Name'] == vehicle_sensors[0]], new_building_location)
-    save_figure(fig, "single_sensors_roads_building")
+    figure_jobs.append((create_air_quality_road_links_site_location_plot, (air_quality_sensor_locations[air_quality_sensor_locations['Sensor_Name'] == 'PER_AIRMON_MONITOR1157100'], road_lines[road_lines['Sensor_Name'] == vehicle_sensors[0]], new_building_location), "single_sensors_roads_building"))
 
     decomposed_timeseries = decompose_timeseries(traffic_timeseries.index, traffic_timeseries[f"{vehicle_sensors[0]}_Journey Time"])
     
-    fig = create_decomposed_trend_plot(decomposed_timeseries)
-    save_figure(fig, "traffic_decomposed_trend")
+    figure_jobs.append((create_decomposed_trend_plot, (decomposed_timeseries,), "traffic_decomposed_trend"))
 
-    fig = create_decomposed_timeseries_plot(decomposed_timeseries)
-    save_figure(fig, "traffic_decomposed_timeseries")
+    figure_jobs.append((create_decomposed_timeseries_plot, (decomposed_timeseries,), "traffic_decomposed_timeseries"))
 
     decomposed_timeseries = decompose_timeseries(air_quality_timeseries.index, air_quality_timeseries["PER_AIRMON_MONITOR1157100_NOx"])
 
-    fig = create_decomposed_trend_plot(decomposed_timeseries)
-    save_figure(fig, "air_decomposed_trend")
+    figure_jobs.append((create_decomposed_trend_plot, (decomposed_timeseries,), "air_decomposed_trend"))
+
+    figure_jobs.append((create_decomposed_timeseries_plot, (decomposed_timeseries,), "air_decomposed_timeseries"))
+
+    air_quality_index = get_index_view(air_quality_timeseries.index)
 
-    fig = create_decomposed_timeseries_plot(decomposed_timeseries)
-    save_figure(fig, "air_decomposed_timeseries")
+    worst_case, normal_case = get_valid_scenario_dates(air_quality_timeseries, "NO2", air_quality_index)
 
-    worst_case, normal_case = get_valid_scenario_dates(air_quality_timeseries, "NO2")
+    figure_jobs.append((create_air_polution_heatmap, (air_quality_timeseries, air_quality_sensor_locations, worst_case, "NO2"), "rush_hour_air_quality"))
 
-    fig = create_air_polution_heatmap(air_quality_timeseries, air_quality_sensor_locations, worst_case, "NO2")
-    save_figure(fig, "rush_hour_air_quality")
+    figure_jobs.append((create_air_polution_heatmap, (air_quality_timeseries, air_quality_sensor_locations, normal_case, "NO2"), "normal_air_quality"))
 
-    fig = create_air_polution_heatmap(air_quality_timeseries, air_quality_sensor_locations, normal_case, "NO2")
-    save_figure(fig, "normal_air_quality")
+    figure_jobs.append((create_sensor_boxplots, (combined_df, air_quality_sensors[0]), "box_plots"))
 
-    fig = create_sensor_boxplots(combined_df, air_quality_sensors[0])
-    save_figure(fig, "box_plots")
+    build_and_save_figures(figure_jobs)
 
 if __name__ == "__main__":
     main()
@@ -1,88 +1,285 @@
 import requests
 import datetime
+import hashlib
+import json
+import pickle
+import threading
 
 import geopandas as gpd
 import pandas as pd
+import numpy as np
+import shapely
 
+from pathlib import Path
+from typing import Union
+from concurrent.futures import ThreadPoolExecutor, Future
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-def get_sensor_locations() -> gpd.GeoDataFrame:
+#Number of sensors whose timeseries are downloaded at the same time.
+MAX_CONCURRENT_SENSORS = 16
+
+#Seconds to wait to connect to the API, and then for it to respond.
+REQUEST_TIMEOUT = (3.05, 30)
+
+#Shared session so repeated requests to the API reuse the same connections.
+session = requests.Session()
+#Every request goes to the same host, so one pool is enough, as long as it has a connection for each concurrent download.
+#Rate limiting and server errors from the API are usually temporary, so retry them with a growing delay before giving up.
+session.mount("https://", HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=max(32, MAX_CONCURRENT_SENSORS),
+    max_retries=Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset(["GET"])
+    )
+))
+#Ask for compressed JSON, which requests decompresses transparently, to cut the size of large catalogue and timeseries responses.
+session.headers.update({"Accept": "application/json", "Accept-Encoding": "gzip, deflate"})
+
+#Location of the cached copy of the full sensor catalogue, alongside the validators used to check it is still current.
+SENSOR_CATALOG_CACHE = Path("outputs/cache/sensor_catalog.pkl")
+
+#Columns of the sensor catalogue that are used, every other field is left out while the catalogue is parsed.
+SENSOR_CATALOG_COLUMNS = ["Sensor_Name", "Broker_Name", "Sensor_Centroid_Longitude", "Sensor_Centroid_Latitude", "Location_WKT"]
+
+#How long the cached catalogue is trusted without asking the API, as the sensor list rarely changes.
+SENSOR_CATALOG_TTL = datetime.timedelta(hours=6)
+
+#Catalogue last read from or written to SENSOR_CATALOG_CACHE, with the file modification time it matches, so later calls in the same run skip unpickling it.
+_loaded_sensor_catalog = {"mtime": None, "cached": None}
+
+#Text columns of the readings that repeat the same few values on every row, so are stored as categories.
+READING_CATEGORY_COLUMNS = ["Variable", "Units"]
+
+#Longest time period requested from the API at once. Longer periods are split into windows of this length that are downloaded at the same time.
+READINGS_WINDOW = datetime.timedelta(days=7)
+
+#Folder of cached readings for time periods that have already ended, and so can never change.
+READINGS_CACHE_DIR = Path("outputs/cache/readings")
+
+#How long after a time period ends before its readings are treated as final, giving the API time to ingest late readings.
+READINGS_CACHE_GRACE = datetime.timedelta(days=1)
+
+#Readings currently being fetched, keyed by sensor and time period, so identical requests made at the same time share one download.
+_in_flight_readings = {}
+_in_flight_lock = threading.Lock()
+
+def get_sensor_catalog() -> pd.DataFrame:
     """
-    Function that gets a full list of sensor locations from the urban observatory API.
+    Function that gets the full sensor catalogue from the urban observatory API, keeping a copy on disk.
+
+    The cached copy is used without any request for SENSOR_CATALOG_TTL after it was last fetched or confirmed. After that it is revalidated with its ETag or Last-Modified header, so the catalogue is only downloaded again when it has changed.
 
-    Returns a GeoPandas GeoDataFrame of sensor names and locations.
+    Returns a Pandas DataFrame of every sensor.
     """
+    cached = None
+    headers = {}
+
+    if SENSOR_CATALOG_CACHE.exists():
+        mtime = SENSOR_CATALOG_CACHE.stat().st_mtime
+
+        if _loaded_sensor_catalog["mtime"] == mtime:
+            cached = _loaded_sensor_catalog["cached"]
+        else:
+            with open(SENSOR_CATALOG_CACHE, "rb") as f:
+                cached = pickle.load(f)
+            _loaded_sensor_catalog.update(mtime=mtime, cached=cached)
+
+        #The file is touched whenever the API confirms it, so its age is the time since the catalogue was last known to be current.
+        age = datetime.datetime.now() - datetime.datetime.fromtimestamp(mtime)
+        if age < SENSOR_CATALOG_TTL:
+            return cached["sensors"].copy()
+
+        if cached["etag"] is not None:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"] is not None:
+            headers["If-Modified-Since"] = cached["last_modified"]
+
     #Send request to UO API, limit disabled.
-    response = requests.get(
-        "https://api.v2.urbanobservatory.ac.uk/sensors/json", {"limit": -1}
+    response = session.get(
+        "https://api.v2.urbanobservatory.ac.uk/sensors/json", params={"limit": -1}, headers=headers, timeout=REQUEST_TIMEOUT
     )
+
+    #Nothing has changed since the cached copy was saved.
+    if response.status_code == 304 and cached is not None:
+        SENSOR_CATALOG_CACHE.touch()
+        _loaded_sensor_catalog["mtime"] = SENSOR_CATALOG_CACHE.stat().st_mtime
+        return cached["sensors"].copy()
+
     if response.ok:
-        #Turn JSON into a python usable format.
-        data = response.json()
-        #Construct dataframe.
-        df = pd.DataFrame(data["Sensors"])
-        #Transform into spatially efficient geodataframe.
-        gdf = gpd.GeoDataFrame(
-            df,
-            geometry=gpd.points_from_xy(
-                df["Sensor_Centroid_Longitude"], df["Sensor_Centroid_Latitude"]
-            ),
-            crs="EPSG:4326",
-        )
-        #Drop unwanted columns.
-        gdf.drop(
-            columns=[
-                "Sensor_Centroid_Longitude",
-                "Sensor_Centroid_Latitude",
-                "Location_WKT",
-                "Ground_Height_Above_Sea_Level",
-                "Sensor_Height_Above_Ground",
-                "Raw_ID",
-            ],
-            inplace=True,
-        )
-        return gdf
+        #Turn JSON into a python usable format, parsing the raw bytes directly rather than decoding the multi megabyte body to text first.
+        data = json.loads(response.content)
+        #Construct dataframe, only taking the used columns from each sensor rather than building every column and dropping most of them.
+        df = pd.DataFrame(data["Sensors"], columns=SENSOR_CATALOG_COLUMNS)
+
+        #Keep a copy even without validators, as it is still reused until the TTL runs out.
+        SENSOR_CATALOG_CACHE.parent.mkdir(parents=True, exist_ok=True)
+        cached = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified"), "sensors": df}
+        with open(SENSOR_CATALOG_CACHE, "wb") as f:
+            pickle.dump(cached, f)
+        _loaded_sensor_catalog.update(mtime=SENSOR_CATALOG_CACHE.stat().st_mtime, cached=cached)
+
+        return df.copy()
     else:
         raise ValueError(f"Bad HTTP Response: Status Code {response.status_code}")
+
+
+def get_sensor_locations(geometry: bool = True) -> Union[gpd.GeoDataFrame, pd.DataFrame]:
+    """
+    Function that gets a full list of sensor locations from the urban observatory API.
+
+    Location_WKT is kept so that get_sensors_wkt can filter this frame instead of fetching the catalogue again.
+
+    If geometry is False, the longitude and latitude columns are kept as plain floats and no point geometries are created.
+
+    Returns a GeoPandas GeoDataFrame of sensor names and locations, or a Pandas DataFrame if geometry is False.
+    """
+    df = get_sensor_catalog()
+
+    if not geometry:
+        return df
+
+    #Create every point in one vectorised call.
+    points = shapely.points(
+        df["Sensor_Centroid_Longitude"].to_numpy(dtype=np.float64),
+        df["Sensor_Centroid_Latitude"].to_numpy(dtype=np.float64)
+    )
+    #Drop unwanted columns before building the geodataframe so they are never carried into it.
+    df = df.drop(
+        columns=[
+            "Sensor_Centroid_Longitude",
+            "Sensor_Centroid_Latitude",
+        ]
+    )
+    #Transform into spatially efficient geodataframe.
+    gdf = gpd.GeoDataFrame(df, geometry=points, crs="EPSG:4326")
+    return gdf
     
-def get_sensors_wkt(sensor_list: list) -> pd.DataFrame:
+def get_sensors_wkt(sensor_list: list, all_sensors_df: Union[gpd.GeoDataFrame, pd.DataFrame, None] = None) -> pd.DataFrame:
     """
     Function that gets a list of sensor WKTs from the urban observatory API.
 
+    If a frame returned by get_sensor_locations, with or without geometry, is passed as all_sensors_df, it is filtered directly instead of requesting the catalogue again.
+
     Returns a Pandas DataFrame of sensor names and WKT onjects.
     """
-    #Send request to UO API, limit disabled.
-    response = requests.get(
-        "https://api.v2.urbanobservatory.ac.uk/sensors/json", {"limit": -1}
-    )
-    if response.ok:
-        #Turn JSON into a python usable format.
-        data = response.json()
-        #Construct dataframe.
-        df = pd.DataFrame(data["Sensors"])
-        #Drop unwanted columns.
-        df.drop(
-            columns=[
-                "Sensor_Centroid_Longitude",
-                "Sensor_Centroid_Latitude",
-                "Ground_Height_Above_Sea_Level",
-                "Sensor_Height_Above_Ground",
-                "Broker_Name",
-                "Raw_ID",
-            ],
-            inplace=True
-            )
-        return df[df["Sensor_Name"].isin(sensor_list)]
+    if all_sensors_df is not None:
+        selected = all_sensors_df[all_sensors_df["Sensor_Name"].isin(set(sensor_list))]
+        return pd.DataFrame(selected[["Sensor_Name", "Location_WKT"]])
 
-    else:
-        raise ValueError(f"Bad HTTP Response: Status Code {response.status_code}")
+    df = get_sensor_catalog()
+    #Keep only the names and WKTs.
+    return df.loc[df["Sensor_Name"].isin(set(sensor_list)), ["Sensor_Name", "Location_WKT"]]
 
-def get_sensor_timeseries(
+def _split_time_period(
+    start_datetime: datetime.datetime, end_datetime: datetime.datetime
+) -> list[tuple[datetime.datetime, datetime.datetime]]:
+    """
+    Function that splits a time period into consecutive windows no longer than READINGS_WINDOW.
+
+    Returns a list of window start and end datetime tuples.
+    """
+    windows = []
+    window_start = start_datetime
+
+    while window_start + READINGS_WINDOW < end_datetime:
+        windows.append((window_start, window_start + READINGS_WINDOW))
+        window_start += READINGS_WINDOW
+
+    windows.append((window_start, end_datetime))
+
+    return windows
+
+def _join_window_readings(window_readings: list[list[dict]]) -> list[dict]:
+    """
+    Function that joins the readings of consecutive time windows, dropping any reading repeated at the boundary between two windows.
+
+    Returns a list of reading dictionaries.
+    """
+    all_readings = []
+    previous = set()
+
+    for readings in window_readings:
+        current = {(reading.get("Timestamp"), reading.get("Variable")) for reading in readings}
+        all_readings.extend(reading for reading in readings if (reading.get("Timestamp"), reading.get("Variable")) not in previous)
+        previous = current
+
+    return all_readings
+
+def _get_sensor_readings(
     sensor_name: str, start_datetime: datetime.datetime, end_datetime: datetime.datetime
-) -> pd.DataFrame:
+) -> list[dict]:
     """
-    Function that gets a timeseries of sensor data from a given sensor on the urban observatory API between two datetimes.
+    Function that gets every raw reading from a given sensor between two datetimes.
 
-    Returns a Pandas DataFrame of sensor data.
+    If the same readings are already being fetched by another thread, waits for and shares that result rather than fetching them again.
+
+    Returns a list of reading dictionaries.
+    """
+    key = (sensor_name, pd.Timestamp(start_datetime).isoformat(), pd.Timestamp(end_datetime).isoformat())
+
+    with _in_flight_lock:
+        future = _in_flight_readings.get(key)
+        is_owner = future is None
+        if is_owner:
+            future = Future()
+            _in_flight_readings[key] = future
+
+    if not is_owner:
+        return future.result()
+
+    try:
+        readings = _load_sensor_readings(sensor_name, start_datetime, end_datetime)
+        future.set_result(readings)
+        return readings
+    except BaseException as error:
+        future.set_exception(error)
+        raise
+    finally:
+        with _in_flight_lock:
+            del _in_flight_readings[key]
+
+def _load_sensor_readings(
+    sensor_name: str, start_datetime: datetime.datetime, end_datetime: datetime.datetime
+) -> list[dict]:
+    """
+    Function that loads every raw reading from a given sensor between two datetimes, from disk if possible.
+
+    Readings for a time period that ended more than READINGS_CACHE_GRACE ago can't change, so they are kept on disk and reused by later runs.
+    Periods that are still going or only recently ended are always downloaded, as are periods with no readings, in case the data just hasn't arrived yet.
+
+    Returns a list of reading dictionaries.
+    """
+    end = pd.Timestamp(end_datetime)
+    if end >= pd.Timestamp.now(tz=end.tz) - READINGS_CACHE_GRACE:
+        return _download_sensor_readings(sensor_name, start_datetime, end_datetime)
+
+    key = hashlib.blake2b(f"{sensor_name}|{pd.Timestamp(start_datetime).isoformat()}|{end.isoformat()}".encode(), digest_size=16).hexdigest()
+    cache_path = READINGS_CACHE_DIR / f"{key}.pkl"
+
+    if cache_path.exists():
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+
+    readings = _download_sensor_readings(sensor_name, start_datetime, end_datetime)
+
+    if readings:
+        READINGS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with open(cache_path, "wb") as f:
+            pickle.dump(readings, f)
+
+    return readings
+
+def _download_sensor_readings(
+    sensor_name: str, start_datetime: datetime.datetime, end_datetime: datetime.datetime
+) -> list[dict]:
+    """
+    Function that downloads every raw reading from a given sensor on the urban observatory API between two datetimes, one page at a time.
+
+    Returns a list of reading dictionaries.
     """
 
     #Set params, this time using a limit to help prevent failed requests for large amounts of data.
@@ -91,21 +288,27 @@ def get_sensor_timeseries(
     offset = 0
     all_readings = []
 
+    #Turn the time period into query values once, in the same form requests would, rather than again for every page.
+    period = {
+        "start": str(start_datetime),
+        "end": str(end_datetime)
+    }
+
     #Loop until there is no more "pages" of data for the given time period.
     while True:
         params = {
             "limit": limit,
             "offset": offset,
-            "start": start_datetime,
-            "end": end_datetime
+            **period
         }
 
-        response = requests.get(base_url, params=params)
+        response = session.get(base_url, params=params, timeout=REQUEST_TIMEOUT)
 
         if not response.ok:
             raise ValueError(f"Bad HTTP Response: Status Code {response.status_code}")
 
-        data = response.json()
+        #Parse the raw bytes of each page directly, so the body is never held as both bytes and decoded text.
+        data = json.loads(response.content)
         readings = data.get("Readings", [])
 
         if not readings:
@@ -118,33 +321,70 @@ def get_sensor_timeseries(
 
         offset += limit
 
+    return all_readings
+
+def get_sensor_timeseries(
+    sensor_name: str, start_datetime: datetime.datetime, end_datetime: datetime.datetime
+) -> pd.DataFrame:
+    """
+    Function that gets a timeseries of sensor data from a given sensor on the urban observatory API between two datetimes.
+
+    Long time periods are split into windows that are downloaded at the same time.
+
+    Returns a Pandas DataFrame of sensor data.
+    """
+
+    windows = _split_time_period(start_datetime, end_datetime)
+
+    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_SENSORS, len(windows))) as executor:
+        window_readings = list(executor.map(lambda window: _get_sensor_readings(sensor_name, *window), windows))
+
+    all_readings = _join_window_readings(window_readings)
+
     if not all_readings:
         return pd.DataFrame()
 
     df = pd.DataFrame(all_readings)
-    df["Timestamp"] = pd.to_datetime(df["Timestamp"])
+    #Timestamps come back as ISO 8601 strings, so parse them directly rather than inferring the format.
+    df["Timestamp"] = pd.to_datetime(df["Timestamp"], format="ISO8601", cache=True)
     df.set_index("Timestamp", inplace=True)
+    _categorise_reading_columns(df)
     return df
+
+def _categorise_reading_columns(df: pd.DataFrame):
+    """
+    Function that stores the repeated text columns of a readings dataframe as categories, in place, matching the archived data read from CSV.
+    """
+    for column in READING_CATEGORY_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
     
-def get_sensor_timeseries_start(sensor_name: str) -> datetime.datetime:
+def _get_reading_timestamp(sensor_name: str, params: Union[dict, None], position: int) -> datetime.datetime:
     """
-    Function that retrieves the start of a sensor's timeseries.
+    Function that requests readings from a sensor and reads the timestamp of the reading at the given position, without building a dataframe for a single value.
 
     Returns a datetime object.
     """
-    #Requests a single line of data with a start param set long in the past.
-    p = {"limit": 1, "start": datetime.datetime(1970,1,1), "end": datetime.datetime.now()}
-    response = requests.get(
-        f"https://api.v2.urbanobservatory.ac.uk/sensors/{sensor_name}/data/json", p
+    response = session.get(
+        f"https://api.v2.urbanobservatory.ac.uk/sensors/{sensor_name}/data/json", params=params, timeout=REQUEST_TIMEOUT
     )
     if response.ok:
-        data = response.json()
-        df = pd.DataFrame(data["Readings"])
-        timestamp_str = df.iloc[0]["Timestamp"]
-        return pd.to_datetime(timestamp_str)
+        data = json.loads(response.content)
+        timestamp_str = data["Readings"][position]["Timestamp"]
+        return pd.to_datetime(timestamp_str, format="ISO8601")
     else:
         raise ValueError("Bad HTTP Response")
 
+def get_sensor_timeseries_start(sensor_name: str) -> datetime.datetime:
+    """
+    Function that retrieves the start of a sensor's timeseries.
+
+    Returns a datetime object.
+    """
+    #Requests a single line of data with a start param set long in the past.
+    p = {"limit": 1, "start": datetime.datetime(1970,1,1), "end": datetime.datetime.now()}
+    return _get_reading_timestamp(sensor_name, p, 0)
+
 def get_sensor_timeseries_end(sensor_name: str) -> datetime.datetime:
     """
     Function that retrieves the end of a sensor's timeseries.
@@ -152,56 +392,77 @@ def get_sensor_timeseries_end(sensor_name: str) -> datetime.datetime:
     Returns a datetime object.
     """    
     #Makes default requets to a sensor and gets the latest line of data.
-    response = requests.get(
-        f"https://api.v2.urbanobservatory.ac.uk/sensors/{sensor_name}/data/json"
-    )
-    if response.ok:
-        data = response.json()
-        df = pd.DataFrame(data["Readings"])
-        timestamp_str = df.iloc[-1]["Timestamp"]
-        return pd.to_datetime(timestamp_str)
-    else:
-        raise ValueError("Bad HTTP Response")
+    return _get_reading_timestamp(sensor_name, None, -1)
+
+def get_sensor_timeseries_range(sensor_name: str) -> tuple[datetime.datetime, datetime.datetime]:
+    """
+    Function that retrieves both the start and end of a sensor's timeseries, requesting them at the same time over the shared session.
+
+    Returns a tuple of datetime objects.
+    """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        start = executor.submit(get_sensor_timeseries_start, sensor_name)
+        end = executor.submit(get_sensor_timeseries_end, sensor_name)
+
+        return start.result(), end.result()
     
 def get_sensors_timeseries(sensors: list[str], start_datetime: datetime.datetime, end_datetime: datetime.datetime) -> pd.DataFrame:
     """
     Function that retrieves and concats data for multiple sensors for a given time period.
 
+    Long time periods are split into windows, and every window of every sensor is downloaded from the same pool.
+
     Returns a Pandas DataFrame of requested data.
     """    
     
-    #Create list of dataframes
-    df_list = []
+    #Create list of readings from every sensor
+    all_readings = []
+    reading_sensors = []
     failed_sensors = []
 
-    #Loop through sensors using existing functions
-    for sensor in sensors:
+    windows = _split_time_period(start_datetime, end_datetime)
+
+    def fetch(job: tuple[str, tuple[datetime.datetime, datetime.datetime]]) -> Union[list[dict], None]:
+        sensor, (window_start, window_end) = job
+        #Only network failures and bad or unreadable responses mark a sensor as failed, anything else is a bug and should not be hidden.
         try:
-            timeseries = get_sensor_timeseries(sensor, start_datetime, end_datetime)
-        except:
+            return _get_sensor_readings(sensor, window_start, window_end)
+        except (requests.RequestException, ValueError):
+            return None
+
+    #Requests spend most of their time waiting on the network, so download several sensors and windows at once
+    jobs = [(sensor, window) for sensor in sensors for window in windows]
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SENSORS) as executor:
+        results = list(executor.map(fetch, jobs))
+
+    #Loop through sensors in their original order, a sensor fails if any of its windows did
+    for i, sensor in enumerate(sensors):
+        window_readings = results[i * len(windows):(i + 1) * len(windows)]
+        if any(readings is None for readings in window_readings):
             failed_sensors.append(sensor)
             continue
-        
-        if timeseries.empty:
-            continue
-        
-        timeseries.reset_index(inplace=True)
-        timeseries["Timestamp"] = pd.to_datetime(timeseries["Timestamp"])
 
-        current_df = timeseries
+        readings = _join_window_readings(window_readings)
 
-        current_df["Sensor_Name"] = sensor
-
-        current_df.set_index("Timestamp", inplace=True)
-        
-        df_list.append(current_df)
+        all_readings.extend(readings)
+        reading_sensors.append((sensor, len(readings)))
         
-    #Stitch list of dataframes together
-    if len(df_list) != 0:    
-        concatenated_df = pd.concat(df_list, ignore_index=False)
+    #Build one dataframe from every reading at once, rather than a dataframe per sensor that then has to be concatenated
+    if len(all_readings) != 0:    
+        concatenated_df = pd.DataFrame(all_readings)
+        concatenated_df["Timestamp"] = pd.to_datetime(concatenated_df["Timestamp"], format="ISO8601", cache=True)
+        #Sensor names are categories in request order, so each row only stores an integer code.
+        sensor_names = [sensor for sensor, _ in reading_sensors]
+        concatenated_df["Sensor_Name"] = pd.Categorical(
+            np.repeat(sensor_names, [count for _, count in reading_sensors]),
+            categories=pd.unique(np.array(sensor_names))
+        )
+        _categorise_reading_columns(concatenated_df)
 
-        concatenated_df.sort_index(inplace=True)
+        concatenated_df.set_index("Timestamp", inplace=True)
+        #Each sensor's readings already arrive in time order, so a stable merge sort only has to interleave the sensors, and keeps them in request order at equal timestamps.
+        concatenated_df.sort_index(inplace=True, kind="mergesort")
 
         return concatenated_df
     else:
-        raise Exception("Error fetching data")
\ No newline at end of file
+        raise Exception("Error fetching data")